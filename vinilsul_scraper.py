@@ -1,12 +1,20 @@
-import json
+import os
 import time
 import re
+import threading
 from collections import deque
-from typing import Dict, List, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+from selectolax.lexbor import LexborHTMLParser, LexborNode
+from urllib3.util.retry import Retry
 
 
 # =============================
@@ -23,32 +31,170 @@ DEFAULT_HEADERS = {
     ),
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
     "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+    # Respostas comprimidas; o urllib3 descomprime brotli quando o pacote "brotli" está instalado
+    "Accept-Encoding": "br, gzip, deflate",
     "Connection": "keep-alive",
 }
 
-# Atraso mínimo entre requisições, em segundos (boas práticas)
-REQUEST_DELAY_SECONDS = 1.0
+# Taxa máxima de requisições por segundo para um mesmo host (boas práticas)
+REQUESTS_PER_SECOND = 2.0
+
+# Quantidade máxima de páginas de produto baixadas simultaneamente
+MAX_WORKERS = 8
+
+# Expressões usadas para quebrar "Informações Técnicas" em linhas e limpar o HTML restante
+_BR_RE = re.compile(r"<br\s*/?>", re.I)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+# charset declarado no cabeçalho Content-Type
+_CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.I)
+
+# Seletores da listagem, montados uma única vez no carregamento do módulo
+PRODUCT_LINK_SELECTOR = ", ".join([
+    "a.woocommerce-LoopProduct-link",
+    "a.woocommerce-loop-product__link",
+    "h2.woocommerce-loop-product__title a",
+    # Fallbacks (alguns temas usam diferentes botões, mas geralmente não são permalinks):
+    "a.button.product_type_simple",
+    "a.button.product_type_variable",
+    "a.button.product_type_grouped",
+    "a.button.product_type_external",
+])
+NEXT_PAGE_SELECTOR = "a.next.page-numbers"
+
+# Parâmetros de rastreamento removidos na canonicalização de URLs
+TRACKING_PARAMS = frozenset({
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "utm_term",
+    "utm_content",
+    "gclid",
+    "fbclid",
+    "ref",
+})
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Cache HTTP em disco (SQLite): reexecuções servem páginas inalteradas localmente
+# e revalidam as expiradas com GETs condicionais (ETag / If-Modified-Since)
+HTTP_CACHE_NAME = "vinilsul_cache"
+# Caminho fixo ao lado deste módulo: execuções a partir de qualquer diretório
+# compartilham o mesmo cache e não criam arquivos no diretório de quem importa
+HTTP_CACHE_PATH = Path(__file__).with_name(HTTP_CACHE_NAME)
+HTTP_CACHE_EXPIRE_SECONDS = 24 * 3600
+# Imagens já são gravadas em disco: nunca passam pelo cache (nem leitura nem escrita)
+HTTP_CACHE_URLS_EXPIRE_AFTER = {
+    "*/wp-content/uploads/*": requests_cache.DO_NOT_CACHE,
+    "*.jpg": requests_cache.DO_NOT_CACHE,
+    "*.jpeg": requests_cache.DO_NOT_CACHE,
+    "*.png": requests_cache.DO_NOT_CACHE,
+    "*.gif": requests_cache.DO_NOT_CACHE,
+    "*.webp": requests_cache.DO_NOT_CACHE,
+    "*.avif": requests_cache.DO_NOT_CACHE,
+}
+
+# Tamanho do pool de conexões mantido por host (reuso de TCP/TLS entre requisições)
+POOL_MAXSIZE = 32
+
+
+def _is_html_response(response: requests.Response) -> bool:
+    """
+    Somente páginas HTML vão para o cache. Respostas que não são 200 passam pelo
+    filtro: a resposta sintética 504 de only_if_cached não tem Content-Type, e
+    rejeitá-la faria o requests-cache apagar a entrada expirada junto com o
+    ETag/Last-Modified, impedindo a revalidação condicional.
+    """
+    return response.status_code != 200 or "text/html" in response.headers.get("Content-Type", "")
 
 
 def create_session() -> requests.Session:
     """
-    Cria uma sessão HTTP com cabeçalhos padrão.
+    Cria uma sessão HTTP com cabeçalhos padrão, cache em disco, pool de conexões
+    persistente e política de novas tentativas para erros transitórios.
     """
-    session = requests.Session()
+    session = requests_cache.CachedSession(
+        str(HTTP_CACHE_PATH),
+        backend="sqlite",
+        expire_after=HTTP_CACHE_EXPIRE_SECONDS,
+        urls_expire_after=HTTP_CACHE_URLS_EXPIRE_AFTER,
+        cache_control=True,
+        filter_fn=_is_html_response,
+    )
     session.headers.update(DEFAULT_HEADERS)
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "HEAD"]),
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session.mount("https://", adapter)
     return session
 
 
-def fetch_html(session: requests.Session, url: str, timeout: int = 30) -> Optional[str]:
+# Sessão compartilhada por todo o processo: todas as URLs estão no mesmo host,
+# então reaproveitar a conexão evita um handshake TCP/TLS por página
+SESSION = create_session()
+
+
+class RateLimiter:
     """
-    Faz uma requisição GET para a URL e retorna o conteúdo HTML como string.
-    Aplica atraso mínimo entre requisições e trata erros de rede.
+    Limita a taxa de requisições por host, de forma segura entre threads.
+    Em vez de dormir um intervalo fixo após cada requisição, reserva o próximo
+    horário livre do host e dorme apenas o tempo que faltar até ele.
+    """
+
+    def __init__(self, rate_per_sec: float = REQUESTS_PER_SECOND) -> None:
+        self.min_interval = 1.0 / rate_per_sec
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        delta = slot - now
+        if delta > 0:
+            time.sleep(delta)
+
+
+# Limitador compartilhado por todas as requisições do processo
+RATE_LIMITER = RateLimiter()
+
+
+def _response_html(response: requests.Response) -> Union[bytes, str]:
+    """
+    Retorna o corpo em bytes quando a página é UTF-8 (ou não declara charset no
+    cabeçalho), pois o Lexbor decodifica bytes sempre como UTF-8 e ignora tanto
+    o <meta charset> quanto o Content-Type. Se o cabeçalho declarar outro
+    charset, decodifica para str com ele (o requests usa o charset do cabeçalho).
+    """
+    match = _CHARSET_RE.search(response.headers.get("Content-Type", ""))
+    if match and match.group(1).lower().replace("_", "-") not in ("utf-8", "utf8"):
+        return response.text
+    return response.content
+
+
+def fetch_html(session: requests.Session, url: str, timeout: int = 30) -> Optional[Union[bytes, str]]:
+    """
+    Faz uma requisição GET para a URL e retorna o conteúdo HTML, em bytes quando
+    UTF-8 (sem decodificar para str: o parser lê os bytes diretamente).
+    Páginas em outro charset só são decodificadas corretamente se o charset vier
+    no cabeçalho Content-Type; um <meta charset> sozinho não é considerado.
+    Respeita a taxa máxima de requisições por host e trata erros de rede.
+    Páginas ainda válidas no cache são servidas sem passar pelo limitador.
     """
     try:
+        if isinstance(session, requests_cache.CachedSession):
+            cached = session.get(url, timeout=timeout, only_if_cached=True)
+            if cached.ok:
+                return _response_html(cached)
+        RATE_LIMITER.wait(url)
         response = session.get(url, timeout=timeout)
-        time.sleep(REQUEST_DELAY_SECONDS)
         response.raise_for_status()
-        return response.text
+        return _response_html(response)
     except requests.RequestException:
         return None
 
@@ -58,6 +204,37 @@ def absolute_url(base_url: str, maybe_relative_url: str) -> str:
     return urljoin(base_url, maybe_relative_url)
 
 
+def canonicalize_url(url: str) -> str:
+    """
+    Normaliza a URL para que variações da mesma página sejam deduplicadas:
+    esquema/host em minúsculas, sem porta padrão, sem fragmento, sem parâmetros
+    de rastreamento e com os demais parâmetros ordenados. O caminho termina
+    sempre com uma única "/", que é a forma canônica do WordPress (evita redirecionamentos).
+    URLs malformadas (ex.: porta inválida) são devolvidas sem alteração; a falha
+    fica para a requisição, que é tratada em fetch_html.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    # Parte do netloc original: preserva credenciais e colchetes de IPv6,
+    # colocando em minúsculas apenas o host e removendo só a porta padrão
+    userinfo, at, hostport = parts.netloc.rpartition("@")
+    hostport = hostport.lower()
+    if port is not None and port == DEFAULT_PORTS.get(scheme):
+        hostport = hostport[:hostport.rfind(":")]
+    netloc = f"{userinfo}{at}{hostport}"
+    path = parts.path.rstrip("/") + "/"
+    query = urlencode(sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
 # =============================
 # Módulo 1: Descoberta de Links de Produtos com Paginação
 # =============================
@@ -70,65 +247,129 @@ def discover_product_urls(start_urls: List[str]) -> List[str]:
     - Encontra links de produtos usando o seletor: a.button.product_type_simple (atributo href)
     - Encontra o link de próxima página usando: a.next.page-numbers
     - Evita duplicidades e loops de paginação
+    - Retorna os produtos na ordem em que foram descobertos
     """
-    session = create_session()
-
-    product_urls: Set[str] = set()
-    visited_listing_pages: Set[str] = set()
-    queue: deque[str] = deque(start_urls)
+    # dict como conjunto ordenado: deduplica mantendo a ordem de descoberta
+    product_urls: Dict[str, None] = {}
+    # Páginas de listagem são marcadas ao entrar na fila, e não ao sair:
+    # assim uma mesma página nunca é enfileirada (nem baixada) duas vezes
+    queue: deque[str] = deque(dict.fromkeys(canonicalize_url(url) for url in start_urls))
+    seen_listing_pages: Set[str] = set(queue)
 
     while queue:
         listing_url = queue.popleft()
-        if listing_url in visited_listing_pages:
-            continue
-        visited_listing_pages.add(listing_url)
 
-        html = fetch_html(session, listing_url)
+        html = fetch_html(SESSION, listing_url)
         if html is None:
             # Falha ao obter a página de listagem; segue para a próxima
             continue
 
-        soup = BeautifulSoup(html, "lxml")
+        tree = LexborHTMLParser(html)
 
         # a) Coletar links de produtos (usar permalink do produto, não botões de carrinho)
-        link_selectors = [
-            "a.woocommerce-LoopProduct-link",
-            "a.woocommerce-loop-product__link",
-            "h2.woocommerce-loop-product__title a",
-            # Fallbacks (alguns temas usam diferentes botões, mas geralmente não são permalinks):
-            "a.button.product_type_simple",
-            "a.button.product_type_variable",
-            "a.button.product_type_grouped",
-            "a.button.product_type_external",
-        ]
-        for a in soup.select(", ".join(link_selectors)):
-            href = a.get("href")
+        for a in tree.css(PRODUCT_LINK_SELECTOR):
+            href = a.attributes.get("href")
             if not href:
                 continue
             full_url = absolute_url(listing_url, href)
             # Normalizar e filtrar para garantir que seja a página de produto
             if "/produto/" not in full_url:
                 continue
-            # Remover querystrings comuns (ex.: add-to-cart)
-            normalized_url = full_url.split("?", 1)[0]
-            product_urls.add(normalized_url)
+            # Remover querystrings comuns (ex.: add-to-cart) e canonicalizar
+            normalized_url = canonicalize_url(full_url.split("?", 1)[0])
+            product_urls[normalized_url] = None
 
         # b) Descobrir próxima página de paginação
-        next_link = soup.select_one("a.next.page-numbers")
+        next_link = tree.css_first(NEXT_PAGE_SELECTOR)
         if next_link is not None:
-            next_href = next_link.get("href")
+            next_href = next_link.attributes.get("href")
             if next_href:
-                next_url = absolute_url(listing_url, next_href)
-                if next_url not in visited_listing_pages:
+                next_url = canonicalize_url(absolute_url(listing_url, next_href))
+                if next_url not in seen_listing_pages:
+                    seen_listing_pages.add(next_url)
                     queue.append(next_url)
 
-    return sorted(product_urls)
+    return list(product_urls)
 
 
 # =============================
 # Módulo 2: Extração Detalhada de Dados do Produto
 # =============================
 
+def empty_product_details(product_url: str) -> Dict:
+    """Registro vazio usado quando não é possível obter ou extrair o produto."""
+    return {
+        "url": product_url,
+        "title": None,
+        "short_description": None,
+        "categories": [],
+        "tags": [],
+        "advantages": [],
+        "technical_info": {},
+    }
+
+
+def _extract_advantages(desc_tab: Optional[LexborNode]) -> List[str]:
+    """Em div#tab-description, extrai os itens da primeira lista após o h2 "Vantagens"."""
+    advantages: List[str] = []
+    if desc_tab is None:
+        return advantages
+
+    # percorre h2 e ul em ordem de documento: localiza o h2 que contenha
+    # o texto "Vantagens" e, em seguida, a primeira lista após ele
+    found_h2 = False
+    ul = None
+    for node in desc_tab.css("h2, ul"):
+        if node.tag == "h2":
+            if not found_h2:
+                heading_text = node.text(separator=" ", strip=True).lower()
+                found_h2 = "vantagens" in heading_text
+        elif found_h2:
+            ul = node
+            break
+
+    if ul is not None:
+        for li in ul.css("li"):
+            txt = li.text(separator=" ", strip=True)
+            if txt:
+                advantages.append(txt)
+    return advantages
+
+
+def _extract_tech_info(desc_tab: Optional[LexborNode]) -> Dict[str, str]:
+    """Em div#tab-description, parseia o p com strong "Informações Técnicas:" em pares chave: valor."""
+    technical_info: Dict[str, str] = {}
+    if desc_tab is None:
+        return technical_info
+
+    target_p = None
+    for p in desc_tab.css("p"):
+        strong = p.css_first("strong")
+        if strong is not None:
+            strong_text = strong.text(separator=" ", strip=True).lower()
+            if "informações técnicas" in strong_text:
+                target_p = p
+                break
+
+    if target_p is not None:
+        # Quebrar o HTML do parágrafo por <br> (qualquer variação) em uma única passada
+        for part in _BR_RE.split(target_p.html or ""):
+            # Remover HTML restante e obter texto limpo
+            part_text = unescape(_TAG_RE.sub("", part)).strip()
+            if not part_text:
+                continue
+            # Ignora a linha de título "Informações Técnicas:"
+            if part_text.lower().startswith("informações técnicas"):
+                continue
+            if ":" in part_text:
+                key, value = part_text.split(":", 1)
+                key = key.strip()
+                value = value.strip()
+                if key:
+                    technical_info[key] = value
+    return technical_info
+
+
 def scrape_product_details(product_url: str) -> Dict:
     """
     Recebe a URL de um produto, baixa o HTML e extrai os dados conforme seletores.
@@ -141,42 +382,35 @@ def scrape_product_details(product_url: str) -> Dict:
       - technical_info: em div#tab-description, p contendo strong "Informações Técnicas:"; parseia linhas chave: valor
       - url: a própria URL do produto
     """
-    session = create_session()
-    html = fetch_html(session, product_url)
+    html = fetch_html(SESSION, product_url)
     if html is None:
-        return {
-            "url": product_url,
-            "title": None,
-            "short_description": None,
-            "categories": [],
-            "tags": [],
-            "advantages": [],
-            "technical_info": {},
-        }
-
-    soup = BeautifulSoup(html, "lxml")
+        return empty_product_details(product_url)
+
+    tree = LexborHTMLParser(html)
+    # aba de descrição: consultada uma única vez e compartilhada por "advantages" e "technical_info"
+    desc_tab = tree.css_first("div#tab-description")
 
     # title
     try:
-        title_el = soup.select_one("h2.product_title.entry-title")
-        title = title_el.get_text(strip=True) if title_el else None
+        title_el = tree.css_first("h2.product_title.entry-title")
+        title = title_el.text(strip=True) if title_el else None
     except Exception:
         title = None
 
     # short_description
     try:
-        sd_el = soup.select_one("div.woocommerce-product-details__short-description")
-        short_description = sd_el.get_text(" ", strip=True) if sd_el else None
+        sd_el = tree.css_first("div.woocommerce-product-details__short-description")
+        short_description = sd_el.text(separator=" ", strip=True) if sd_el else None
     except Exception:
         short_description = None
 
     # categories
     categories: List[str] = []
     try:
-        cat_span = soup.select_one("span.posted_in")
+        cat_span = tree.css_first("span.posted_in")
         if cat_span is not None:
-            for a in cat_span.select("a"):
-                text = (a.get_text(strip=True) or "").strip()
+            for a in cat_span.css("a"):
+                text = (a.text(strip=True) or "").strip()
                 if text:
                     categories.append(text)
     except Exception:
@@ -185,78 +419,24 @@ def scrape_product_details(product_url: str) -> Dict:
     # tags
     tags: List[str] = []
     try:
-        tag_span = soup.select_one("span.tagged_as")
+        tag_span = tree.css_first("span.tagged_as")
         if tag_span is not None:
-            for a in tag_span.select("a"):
-                text = (a.get_text(strip=True) or "").strip()
+            for a in tag_span.css("a"):
+                text = (a.text(strip=True) or "").strip()
                 if text:
                     tags.append(text)
     except Exception:
         tags = []
 
     # advantages
-    advantages: List[str] = []
     try:
-        desc_tab = soup.select_one("div#tab-description")
-        if desc_tab is not None:
-            # localiza h2 que contenha o texto "Vantagens"
-            h2_list = desc_tab.select("h2")
-            target_h2 = None
-            for h2 in h2_list:
-                heading_text = h2.get_text(" ", strip=True).lower()
-                if "vantagens" in heading_text:
-                    target_h2 = h2
-                    break
-
-            if target_h2 is not None:
-                # procura a primeira lista após o h2
-                ul = target_h2.find_next("ul")
-                if ul is not None:
-                    for li in ul.select("li"):
-                        txt = li.get_text(" ", strip=True)
-                        if txt:
-                            advantages.append(txt)
+        advantages = _extract_advantages(desc_tab)
     except Exception:
         advantages = []
 
     # technical_info
-    technical_info: Dict[str, str] = {}
     try:
-        desc_tab = desc_tab or soup.select_one("div#tab-description")
-        if desc_tab is not None:
-            p_list = desc_tab.select("p")
-            target_p = None
-            for p in p_list:
-                strong = p.find("strong")
-                if strong is not None:
-                    strong_text = strong.get_text(" ", strip=True).lower()
-                    if "informações técnicas" in strong_text:
-                        target_p = p
-                        break
-
-            if target_p is not None:
-                # Converter conteúdo HTML do parágrafo e quebrar por <br>
-                raw_html = target_p.decode_contents()
-                # Normalizar tags <br>
-                normalized = raw_html.replace("<br/>", "<br>").replace("<br />", "<br>")
-                # Quebrar por <br>
-                parts = [s.strip() for s in normalized.split("<br>")]
-                for part in parts:
-                    if not part:
-                        continue
-                    # Remover HTML restante e obter texto limpo
-                    part_text = BeautifulSoup(part, "lxml").get_text(" ", strip=True)
-                    if not part_text:
-                        continue
-                    # Ignora a linha de título "Informações Técnicas:"
-                    if part_text.lower().startswith("informações técnicas"):
-                        continue
-                    if ":" in part_text:
-                        key, value = part_text.split(":", 1)
-                        key = key.strip()
-                        value = value.strip()
-                        if key:
-                            technical_info[key] = value
+        technical_info = _extract_tech_info(desc_tab)
     except Exception:
         technical_info = {}
 
@@ -291,6 +471,15 @@ def parse_start_urls_from_input(user_input: str) -> List[str]:
     return urls
 
 
+def _safe_scrape_product_details(product_url: str) -> Dict:
+    """Executa scrape_product_details sem propagar exceções para o pool de threads."""
+    try:
+        return scrape_product_details(product_url)
+    except Exception:
+        # Em caso de erro inesperado, registramos e continuamos
+        return empty_product_details(product_url)
+
+
 def main() -> None:
     # Pergunta URLs ao usuário
     print("Informe a(s) URL(s) de categoria/listagem da Vinilsul para scraping.")
@@ -306,30 +495,26 @@ def main() -> None:
     product_urls = discover_product_urls(start_urls)
     print(f"Total de produtos encontrados: {len(product_urls)}")
 
-    # 2) Percorrer os produtos e extrair detalhes
-    results: List[Dict] = []
-    total = len(product_urls)
-    for idx, url in enumerate(product_urls, start=1):
-        try:
-            print(f"[{idx}/{total}] Extraindo: {url}")
-            details = scrape_product_details(url)
-            results.append(details)
-        except Exception:
-            # Em caso de erro inesperado, registramos e continuamos
-            results.append({
-                "url": url,
-                "title": None,
-                "short_description": None,
-                "categories": [],
-                "tags": [],
-                "advantages": [],
-                "technical_info": {},
-            })
-
-    # 3) Salvar em JSON
+    # 2) Percorrer os produtos em paralelo (mantendo a ordem) e gravar cada
+    #    resultado assim que fica pronto, sem acumular a lista de resultados.
+    #    O arquivo continua sendo um único array JSON, montado manualmente;
+    #    o orjson gera UTF-8 diretamente, por isso o arquivo é aberto em modo binário.
+    #    A escrita vai para um arquivo temporário, que só substitui o final quando
+    #    o array está completo: uma execução interrompida não corrompe a saída anterior.
     output_file = "vinilsul_produtos.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
+    tmp_file = f"{output_file}.tmp"
+    total = len(product_urls)
+    with open(tmp_file, "wb") as f, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        f.write(b"[\n")
+        details_iter = executor.map(_safe_scrape_product_details, product_urls)
+        for idx, (url, details) in enumerate(zip(product_urls, details_iter), start=1):
+            print(f"[{idx}/{total}] Extraído: {url}")
+            if idx > 1:
+                f.write(b",\n")
+            f.write(orjson.dumps(details))
+        f.write(b"\n]\n")
+    os.replace(tmp_file, output_file)
 
     print(f"Arquivo gerado: {output_file}")
 
@@ -1,15 +1,20 @@
 import csv
 import random
 import re
+import shutil
 import time
-from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from operator import attrgetter
 from pathlib import Path
-from typing import List, Optional, Set, Tuple
+from typing import List, Optional, Set, Tuple, Union
 from urllib.parse import urlparse
 
+import soupsieve as sv
 from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
-import requests
+
+from vinilsul_scraper import SESSION, fetch_html
 
 
 BASE_URL = "https://www.vinilsul.com.br/categoria-produto/portfolio-estamparia-digital/"
@@ -23,6 +28,32 @@ USER_AGENTS = [
 ]
 
 
+# Imagens sem compressão de transporte: o Content-Length do HEAD precisa ser
+# comparável ao tamanho do arquivo gravado (já decodificado)
+_IMAGE_HEADERS = {"Accept-Encoding": "identity"}
+
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+_FNAME_RE = re.compile(r"[^\w.\-]")
+
+# Seletores CSS compilados uma única vez (o soupsieve não precisa reprocessar a string a cada chamada)
+_SEL_PRODUCT_LINK = sv.compile("li.product a.woocommerce-LoopProduct-link, li.product a.woocommerce-loop-product__link")
+_SEL_PRODUCT_CARD_LINK = sv.compile("li.product a")
+_SEL_NEXT_PAGE = sv.compile("a.next, li.next a, a.page-numbers.next")
+_SEL_TITLE = sv.compile("h2.product_title.entry-title")
+_SEL_TITLE_H1 = sv.compile("h1.product_title")
+_SEL_H1 = sv.compile("h1")
+_SEL_SKU = sv.compile(".sku")
+_SEL_META = sv.compile("div.product_meta")
+_SEL_CATEGORY_LINK = sv.compile("span.posted_in a")
+_SEL_SPAN = sv.compile("span")
+_SEL_ANCHOR = sv.compile("a")
+_SEL_BREADCRUMB_LINK = sv.compile("nav.woocommerce-breadcrumb a")
+_SEL_SHORT_DESC = sv.compile("div.woocommerce-product-details__short-description")
+_SEL_TAB_DESC = sv.compile("#tab-description")
+_SEL_TAB_DESC_PANEL = sv.compile("div.woocommerce-Tabs-panel--description")
+_SEL_GALLERY_IMG = sv.compile("figure.woocommerce-product-gallery img, div.woocommerce-product-gallery img")
+
+
 @dataclass
 class Produto:
     nome: str
@@ -34,6 +65,10 @@ class Produto:
     url: str
 
 
+CSV_FIELDS = [field.name for field in fields(Produto)]
+_produto_row = attrgetter(*CSV_FIELDS)
+
+
 class VinilSulScraper:
     def __init__(
         self,
@@ -42,43 +77,49 @@ class VinilSulScraper:
         images_dir: str = "imagens_vinilsul",
         min_delay: float = 1.5,
         max_delay: float = 4.0,
+        image_workers: int = 8,
     ) -> None:
         self.base_url = base_url
         self.output_csv = output_csv
         self.images_dir = Path(images_dir)
         self.min_delay = min_delay
         self.max_delay = max_delay
+        self.image_workers = image_workers
         self.user_agent = random.choice(USER_AGENTS)
+        # Um único User-Agent por execução: páginas, imagens e o fallback com navegador
+        SESSION.headers["User-Agent"] = self.user_agent
 
     def _sleep(self) -> None:
         time.sleep(random.uniform(self.min_delay, self.max_delay))
 
-    def _parse_product_links(self, html: str) -> List[str]:
-        soup = BeautifulSoup(html, "html.parser")
+    def _parse(self, html: Union[bytes, str]) -> BeautifulSoup:
+        # lxml (implementado em C) é bem mais rápido que o "html.parser" puro Python
+        return BeautifulSoup(html, "lxml")
+
+    def _parse_product_links(self, soup: BeautifulSoup) -> List[str]:
         links: List[str] = []
-        for anchor in soup.select("li.product a.woocommerce-LoopProduct-link, li.product a.woocommerce-loop-product__link"):
+        for anchor in _SEL_PRODUCT_LINK.select(soup):
             href = anchor.get("href")
             if href:
                 links.append(href)
         # Fallback: any product card link
         if not links:
-            for anchor in soup.select("li.product a"):
+            for anchor in _SEL_PRODUCT_CARD_LINK.select(soup):
                 href = anchor.get("href")
                 if href and "/produto/" in href:
                     links.append(href)
         return list(dict.fromkeys(links))
 
-    def _get_next_page(self, html: str) -> Optional[str]:
-        soup = BeautifulSoup(html, "html.parser")
-        next_link = soup.select_one("a.next, li.next a, a.page-numbers.next")
+    def _get_next_page(self, soup: BeautifulSoup) -> Optional[str]:
+        next_link = _SEL_NEXT_PAGE.select_one(soup)
         if next_link and next_link.get("href"):
             return next_link["href"]
         return None
 
-    def _slugify(self, value: str) -> str:
-        value = value.strip().lower()
-        value = re.sub(r"[^a-z0-9]+", "-", value)
-        return value.strip("-")
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _slugify(value: str) -> str:
+        return _SLUG_RE.sub("-", value.strip().lower()).strip("-")
 
     def _filename_from_url(self, url: str, index: int) -> str:
         parsed = urlparse(url)
@@ -87,7 +128,42 @@ class VinilSulScraper:
             return f"imagem_{index}.jpg"
         if "." not in name:
             name = f"{name}.jpg"
-        return re.sub(r"[^\w.\-]", "_", name)
+        return _FNAME_RE.sub("_", name)
+
+    def _download_image(self, img_url: str, file_path: Path) -> None:
+        with SESSION.get(
+            img_url,
+            headers=_IMAGE_HEADERS,
+            timeout=30,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=65536)
+
+    def _needs_download(self, img_url: str, file_path: Path) -> bool:
+        # Arquivo já existente só é baixado de novo se o tamanho divergir do Content-Length (HEAD)
+        try:
+            local_size = file_path.stat().st_size
+        except FileNotFoundError:
+            return True
+        try:
+            response = SESSION.head(
+                img_url,
+                headers=_IMAGE_HEADERS,
+                timeout=30,
+                allow_redirects=True,
+            )
+            response.raise_for_status()
+        except Exception:
+            return False
+        remote_size = response.headers.get("Content-Length")
+        return remote_size is not None and remote_size.isdigit() and int(remote_size) != local_size
+
+    def _sync_image(self, img_url: str, file_path: Path) -> None:
+        if self._needs_download(img_url, file_path):
+            self._download_image(img_url, file_path)
 
     def _download_images(self, image_urls: List[str], product_name: str, product_url: str) -> List[str]:
         if not image_urls:
@@ -97,67 +173,71 @@ class VinilSulScraper:
         product_dir = self.images_dir / folder_name
         product_dir.mkdir(parents=True, exist_ok=True)
 
-        relative_paths: List[str] = []
+        # Nomes de arquivo únicos por produto: URLs diferentes com o mesmo nome
+        # (ex.: uploads/2023/01/foto.jpg e uploads/2024/02/foto.jpg) não podem
+        # ser gravadas no mesmo arquivo por duas threads ao mesmo tempo
+        pairs: List[Tuple[str, str]] = []
+        used_filenames: Set[str] = set()
         for idx, img_url in enumerate(image_urls, start=1):
+            filename = self._filename_from_url(img_url, idx)
+            while filename in used_filenames:
+                filename = f"{idx}_{filename}"
+            used_filenames.add(filename)
+            pairs.append((img_url, filename))
+        with ThreadPoolExecutor(max_workers=self.image_workers) as executor:
+            futures = [
+                executor.submit(self._sync_image, img_url, product_dir / filename)
+                for img_url, filename in pairs
+            ]
+
+        relative_paths: List[str] = []
+        for (img_url, filename), future in zip(pairs, futures):
             try:
-                filename = self._filename_from_url(img_url, idx)
-                file_path = product_dir / filename
-                if not file_path.exists():
-                    response = requests.get(
-                        img_url,
-                        headers={"User-Agent": self.user_agent},
-                        timeout=30,
-                        stream=True,
-                    )
-                    response.raise_for_status()
-                    with open(file_path, "wb") as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
+                future.result()
                 relative_paths.append(str(Path(self.images_dir.name) / folder_name / filename))
             except Exception as exc:
                 print(f"Erro ao baixar imagem {img_url}: {exc}")
         return relative_paths
 
-    def _extract_product_details(self, html: str, url: str) -> Tuple[Produto, List[str]]:
-        soup = BeautifulSoup(html, "html.parser")
-        title_el = soup.select_one("h2.product_title.entry-title") or soup.select_one("h1.product_title") or soup.select_one("h1")
+    def _extract_product_details(self, html: Union[bytes, str], url: str) -> Tuple[Produto, List[str]]:
+        soup = self._parse(html)
+        title_el = _SEL_TITLE.select_one(soup) or _SEL_TITLE_H1.select_one(soup) or _SEL_H1.select_one(soup)
         name = title_el.get_text(strip=True) if title_el else ""
 
         sku = ""
-        sku_el = soup.select_one(".sku")
+        sku_el = _SEL_SKU.select_one(soup)
         if sku_el:
             sku = sku_el.get_text(strip=True)
 
         categoria = ""
         marca = ""
-        meta = soup.select_one("div.product_meta")
+        meta = _SEL_META.select_one(soup)
         if meta:
-            categorias = [a.get_text(strip=True) for a in meta.select("span.posted_in a") if a.get_text(strip=True)]
+            categorias = [a.get_text(strip=True) for a in _SEL_CATEGORY_LINK.select(meta) if a.get_text(strip=True)]
             if categorias:
                 categoria = " > ".join(categorias)
-            for span in meta.select("span"):
+            for span in _SEL_SPAN.select(meta):
                 span_text = span.get_text(" ", strip=True)
                 if "Marca" in span_text:
-                    marcas = [a.get_text(strip=True) for a in span.select("a") if a.get_text(strip=True)]
+                    marcas = [a.get_text(strip=True) for a in _SEL_ANCHOR.select(span) if a.get_text(strip=True)]
                     if marcas:
                         marca = ", ".join(dict.fromkeys(marcas))
                     break
         if not categoria:
-            breadcrumbs = [crumb.get_text(strip=True) for crumb in soup.select("nav.woocommerce-breadcrumb a")]
+            breadcrumbs = [crumb.get_text(strip=True) for crumb in _SEL_BREADCRUMB_LINK.select(soup)]
             categoria = " > ".join([b for b in breadcrumbs if b])
 
         descricao_parts = []
-        short_desc = soup.select_one("div.woocommerce-product-details__short-description")
+        short_desc = _SEL_SHORT_DESC.select_one(soup)
         if short_desc:
             descricao_parts.append(short_desc.get_text(" ", strip=True))
-        long_desc = soup.select_one("#tab-description") or soup.select_one("div.woocommerce-Tabs-panel--description")
+        long_desc = _SEL_TAB_DESC.select_one(soup) or _SEL_TAB_DESC_PANEL.select_one(soup)
         if long_desc:
             descricao_parts.append(long_desc.get_text(" ", strip=True))
         descricao = " | ".join([p for p in descricao_parts if p])
 
         images: List[str] = []
-        for img in soup.select("figure.woocommerce-product-gallery img, div.woocommerce-product-gallery img"):
+        for img in _SEL_GALLERY_IMG.select(soup):
             src = img.get("data-src") or img.get("src")
             if src:
                 images.append(src)
@@ -175,67 +255,84 @@ class VinilSulScraper:
 
     def _write_csv(self, produtos: List[Produto]) -> None:
         with open(self.output_csv, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(
-                f,
-                fieldnames=["nome", "sku", "categoria", "marca", "descricao", "imagens", "url"],
-            )
-            writer.writeheader()
-            for produto in produtos:
-                writer.writerow(asdict(produto))
-
-    def run(self) -> None:
-        produtos: List[Produto] = []
-        seen_links: Set[str] = set()
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDS)
+            # Tuplas direto dos atributos: evita o asdict (cópia profunda) e o mapeamento por linha do DictWriter
+            writer.writerows(map(_produto_row, produtos))
+
+    def _render_with_browser(self, url: str) -> Optional[str]:
+        """Fallback para páginas cujo HTML estático não traz produtos: renderiza com Chromium."""
+        try:
+            from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+        except ImportError:
+            print("Playwright não está instalado; fallback com navegador indisponível.")
+            return None
 
         with sync_playwright() as p:
             browser = p.chromium.launch(headless=True)
-            context = browser.new_context(
-                user_agent=self.user_agent,
-                locale="pt-BR",
-            )
-            page = context.new_page()
-
-            current_url = self.base_url
-            page_index = 1
-            while current_url:
-                print(f"Processando página {page_index}... {current_url}")
+            try:
+                context = browser.new_context(
+                    user_agent=self.user_agent,
+                    locale="pt-BR",
+                )
+                page = context.new_page()
                 try:
-                    page.goto(current_url, wait_until="domcontentloaded", timeout=60000)
+                    page.goto(url, wait_until="domcontentloaded", timeout=60000)
                 except PlaywrightTimeoutError:
-                    print(f"Timeout ao carregar página: {current_url}")
-                    break
+                    print(f"Timeout ao carregar página: {url}")
+                    return None
+                # str direto: como bytes, o BeautifulSoup confiaria no <meta charset> original da página
+                return page.content()
+            finally:
+                browser.close()
 
-                self._sleep()
-                html = page.content()
-                product_links = self._parse_product_links(html)
-                if not product_links:
-                    print("Nenhum produto encontrado. Encerrando.")
-                    break
+    def run(self) -> None:
+        produtos: List[Produto] = []
+        seen_links: Set[str] = set()
 
-                for link in product_links:
-                    if link in seen_links:
-                        continue
-                    seen_links.add(link)
-                    print(f"Extraindo produto: {link}")
-                    try:
-                        page.goto(link, wait_until="domcontentloaded", timeout=60000)
-                        self._sleep()
-                        product_html = page.content()
-                        produto, image_urls = self._extract_product_details(product_html, link)
-                        imagens_rel = self._download_images(image_urls, produto.nome, link)
-                        produto.imagens = ",".join(imagens_rel)
-                        produtos.append(produto)
-                    except Exception as exc:
-                        print(f"Erro ao extrair produto {link}: {exc}")
+        current_url = self.base_url
+        page_index = 1
+        while current_url:
+            print(f"Processando página {page_index}... {current_url}")
+            # fetch_html já aplica o limitador de taxa por host (e serve páginas do cache sem espera)
+            html = fetch_html(SESSION, current_url)
+            # A página de listagem é parseada uma única vez para links de produtos e paginação
+            soup = self._parse(html) if html is not None else None
+            product_links = self._parse_product_links(soup) if soup is not None else []
+            if not product_links:
+                print("Nenhum produto no HTML da página; tentando renderizar com o navegador...")
+                html = self._render_with_browser(current_url)
+                # O navegador não passa pelo limitador de fetch_html; mantém o atraso aleatório
+                self._sleep()
+                soup = self._parse(html) if html is not None else None
+                product_links = self._parse_product_links(soup) if soup is not None else []
+            if not product_links:
+                print("Nenhum produto encontrado. Encerrando.")
+                break
+
+            for link in product_links:
+                if link in seen_links:
+                    continue
+                seen_links.add(link)
+                print(f"Extraindo produto: {link}")
+                try:
+                    product_html = fetch_html(SESSION, link)
+                    if product_html is None:
+                        print(f"Erro ao extrair produto {link}: falha ao baixar a página")
                         continue
-
-                next_url = self._get_next_page(html)
-                if not next_url or next_url == current_url:
-                    break
-                current_url = next_url
-                page_index += 1
-
-            browser.close()
+                    produto, image_urls = self._extract_product_details(product_html, link)
+                    imagens_rel = self._download_images(image_urls, produto.nome, link)
+                    produto.imagens = ",".join(imagens_rel)
+                    produtos.append(produto)
+                except Exception as exc:
+                    print(f"Erro ao extrair produto {link}: {exc}")
+                    continue
+
+            next_url = self._get_next_page(soup)
+            if not next_url or next_url == current_url:
+                break
+            current_url = next_url
+            page_index += 1
 
         self._write_csv(produtos)
         print(f"Concluído! {len(produtos)} produtos salvos em {self.output_csv}")